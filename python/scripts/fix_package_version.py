@@ -17,14 +17,19 @@ from __future__ import annotations
 
 import re
 import subprocess
+import sys
 from pathlib import Path
 
+REPO_ROOT_DIR = Path(__file__).resolve().parent.parent.parent
+
+_CARGO_VERSION_RE = re.compile(r'version = "([A-Za-z0-9.-]+)".*')
+_INIT_VERSION_RE = re.compile(r'__version__ = "([A-Za-z0-9.-]+)"')
+
 
 # TODO(https://github.com/PyO3/maturin/issues/2163): Remove this file when fixed.
 def main() -> None:
-    repo_root_dir = Path(__file__).parent.parent.parent
-    python_root_dir = repo_root_dir / "python"
-    rust_root_dir = repo_root_dir / "rust"
+    python_root_dir = REPO_ROOT_DIR / "python"
+    rust_root_dir = REPO_ROOT_DIR / "rust"
     # Compute paths to files we'll need to restore at the end of the build
     rust_main_rs_path = rust_root_dir / "cli" / "src" / "main.rs"
     rust_cli_cargo_toml_path = rust_root_dir / "cli" / "Cargo.toml"
@@ -37,20 +42,30 @@ def main() -> None:
     python_version = get_python_version(python_root_dir)
     patch_cargo_toml_with_version(rust_cli_cargo_toml_path, python_version)
 
-    # update Cargo.lock
-    subprocess.run(["cargo", "check"], cwd=rust_root_dir / "cli", check=True)
+    # update Cargo.lock; we only care about the exit code, so we discard
+    # stdout and only surface stderr if something goes wrong.
+    p = subprocess.run(
+        ["cargo", "check"],
+        cwd=rust_root_dir / "cli",
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if p.returncode != 0:
+        print(f"ERROR: cargo check failed:\n{p.stderr}")
+        sys.exit(1)
 
 
 def get_rust_version(rust_root_dir: Path) -> str:
     cargo_path = rust_root_dir / "cli" / "Cargo.toml"
-    version = extract_with_regex(cargo_path, 'version = "([A-Za-z0-9.-]+)".*')
+    version = extract_with_regex(cargo_path, _CARGO_VERSION_RE)
     print(f"Extracted rust version: {version}")
     return version
 
 
 def get_python_version(python_root_dir: Path) -> str:
     init_path = python_root_dir / "src" / "magika" / "__init__.py"
-    version = extract_with_regex(init_path, '__version__ = "([A-Za-z0-9.-]+)"')
+    version = extract_with_regex(init_path, _INIT_VERSION_RE)
     print(f"Extracted python version: {version}")
     return version
 
@@ -69,22 +84,22 @@ def patch_cargo_toml_with_version(cargo_toml_path: Path, version: str) -> None:
     patch_line_matching_prefix(cargo_toml_path, "version = ", f'version = "{version}"')
 
 
-def extract_with_regex(file_path: Path, regex: str) -> str:
+def extract_with_regex(file_path: Path, pattern: re.Pattern[str]) -> str:
     """Extract a string via regex. This raises an exception if no or more than
     one matches are found."""
 
     lines = file_path.read_text().split("\n")
     output = None
     for line in lines:
-        m = re.fullmatch(regex, line)
+        m = pattern.fullmatch(line)
         if m:
             if output is not None:
                 raise Exception(
-                    f'ERROR: Found more than one match for "{regex}" in {file_path}'
+                    f'ERROR: Found more than one match for "{pattern.pattern}" in {file_path}'
                 )
             output = m.group(1)
     if output is None:
-        raise Exception(f'No hits for "{regex}" in {file_path}')
+        raise Exception(f'No hits for "{pattern.pattern}" in {file_path}')
     return output
 
 
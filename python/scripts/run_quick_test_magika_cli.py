@@ -30,6 +30,8 @@ from typing import Optional
 
 import click
 
+BASIC_TESTS_DIR = Path(__file__).resolve().parent.parent.parent / "tests_data" / "basic"
+
 
 @click.command()
 @click.option(
@@ -42,10 +44,7 @@ def main(client_path: Optional[Path]) -> None:
     executable.
     """
 
-    basic_tests_dir = (
-        Path(__file__).resolve().parent.parent.parent / "tests_data" / "basic"
-    )
-    assert basic_tests_dir.is_dir()
+    assert BASIC_TESTS_DIR.is_dir()
 
     if client_path is None:
         client_path = Path("magika")
@@ -55,7 +54,7 @@ def main(client_path: Optional[Path]) -> None:
     print(f'Output of "magika --version": {p.stdout.strip()}')
 
     p = subprocess.run(
-        [str(client_path), "-r", "--label", "--no-colors", str(basic_tests_dir)],
+        [str(client_path), "-r", "--label", "--no-colors", str(BASIC_TESTS_DIR)],
         capture_output=True,
         text=True,
     )
@@ -66,26 +65,26 @@ def main(client_path: Optional[Path]) -> None:
         print(f"stderr:\n{p.stderr}\n" + "-" * 40)
         sys.exit(1)
 
-    if p.stderr != "":
+    if p.stderr:
         print(f"WARNING: p.stderr not empty: {p.stderr}")
 
-    with_error = False
-    lines = p.stdout.split("\n")
-    for line in lines:
-        line = line.strip()
-        if line == "":
-            continue
+    predictions = []
+    for line in p.stdout.splitlines():
         file_path_str, file_output_str = line.split(": ", 1)
-        file_path = Path(file_path_str)
         output_label = file_output_str.strip().split(" ", 1)[0]
-        expected_label = file_path.parent.name
-        if expected_label != output_label:
-            with_error = True
-            print(
-                f"ERROR: Misprediction for {file_path}: expected_label={expected_label}, output_label={output_label}"
-            )
-
-    if with_error:
+        predictions.append((Path(file_path_str), output_label))
+
+    mispredictions = [
+        (file_path, output_label)
+        for file_path, output_label in predictions
+        if file_path.parent.name != output_label
+    ]
+    for file_path, output_label in mispredictions:
+        print(
+            f"ERROR: Misprediction for {file_path}: expected_label={file_path.parent.name}, output_label={output_label}"
+        )
+
+    if mispredictions:
         print("ERROR: There was at least one misprediction")
         sys.exit(1)
 
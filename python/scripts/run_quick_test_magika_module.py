@@ -26,6 +26,8 @@ import click
 
 from magika import ContentTypeLabel, Magika, PredictionMode
 
+BASIC_TESTS_DIR = Path(__file__).resolve().parent.parent.parent / "tests_data" / "basic"
+
 
 @click.command()
 def main() -> None:
@@ -43,11 +45,7 @@ def main() -> None:
     assert res.output.label == ContentTypeLabel.UNKNOWN
     assert res.score == 1.0
 
-    basic_tests_dir = (
-        Path(__file__).parent.parent.parent / "tests_data" / "basic"
-    ).resolve()
-
-    files_paths = sorted(filter(lambda p: p.is_file(), basic_tests_dir.rglob("*")))
+    files_paths = sorted(filter(lambda p: p.is_file(), BASIC_TESTS_DIR.rglob("*")))
 
     with_error = False
     for file_path in files_paths:
@@ -21,14 +21,18 @@ predictions are correct, and raise an error otherwise.
 This is useful when evaluating new models.
 """
 
+import os
 import sys
 from pathlib import Path
+from typing import Iterator
 
 import click
 
 import magika
 from magika import colors
 
+TESTS_DATA_DIR = Path(__file__).resolve().parent.parent.parent / "tests_data"
+
 
 @click.command()
 @click.argument("model_dir_or_name")
@@ -47,16 +51,14 @@ def main(model_dir_or_name: str) -> None:
 
     with_error = False
 
-    tests_data_dir = Path(__file__).parent.parent.parent / "tests_data"
     tests_dirs_names = ["basic", "previous_missdetections"]
 
     for tests_dir_name in tests_dirs_names:
-        tests_dir = tests_data_dir / tests_dir_name
-        for test_path in tests_dir.rglob("*"):
-            if not test_path.is_file():
-                continue
-
-            mr = m.identify_path(test_path)
+        tests_dir = TESTS_DATA_DIR / tests_dir_name
+        tests_paths = list(iter_test_files(tests_dir))
+        # We identify all files at once so that inference is batched.
+        results = m.identify_paths(tests_paths)
+        for test_path, mr in zip(tests_paths, results):
             assert mr.ok
 
             prediceted_content_type = mr.prediction.output.label
@@ -73,6 +75,13 @@ def main(model_dir_or_name: str) -> None:
         log_ok("All tests examples were predicted correctly.")
 
 
+def iter_test_files(tests_dir: Path) -> Iterator[Path]:
+    # os.walk relies on os.scandir, which avoids a stat() call per entry.
+    for dir_path, _, file_names in os.walk(tests_dir):
+        for file_name in file_names:
+            yield Path(dir_path) / file_name
+
+
 def log_ok(msg: str) -> None:
     print(f"{colors.GREEN}{msg}{colors.RESET}")
 
@@ -16,14 +16,41 @@
 __version__ = "0.6.1-dev"
 
 
-import dotenv
+import os
+from typing import TYPE_CHECKING, Any
 
-from magika import magika
 from magika.types import content_type_label, magika_error, prediction_mode
 
-Magika = magika.Magika
+if TYPE_CHECKING:
+    from magika.magika import Magika
+
 MagikaError = magika_error.MagikaError
 ContentTypeLabel = content_type_label.ContentTypeLabel
 PredictionMode = prediction_mode.PredictionMode
 
-dotenv.load_dotenv(dotenv.find_dotenv())
+__all__ = ["ContentTypeLabel", "Magika", "MagikaError", "PredictionMode"]
+
+
+def __getattr__(name: str) -> Any:
+    # Importing magika.magika pulls in onnxruntime and numpy, which take a
+    # while; we only do that when Magika is actually accessed (PEP 562).
+    if name == "Magika":
+        from magika.magika import Magika
+
+        globals()["Magika"] = Magika
+        return Magika
+    if name == "magika":
+        # The magika.magika submodule used to be imported eagerly, and thus was
+        # reachable as an attribute of this package.
+        import magika.magika
+
+        return magika.magika
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Looking for a .env file requires walking up the directory tree; library users
+# need to explicitly opt in. The CLI always loads it.
+if os.environ.get("MAGIKA_USE_DOTENV") == "1":
+    import dotenv
+
+    dotenv.load_dotenv(dotenv.find_dotenv())
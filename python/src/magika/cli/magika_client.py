@@ -13,39 +13,65 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import dataclasses
-import importlib.metadata
+import functools
+import itertools
 import json
 import logging
 import os
+import stat
 import sys
+import textwrap
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import click
+import dotenv
 
 from magika import Magika, MagikaError, PredictionMode, colors
 from magika.logger import get_logger
 from magika.types import ContentTypeLabel, MagikaResult
 from magika.types.overwrite_reason import OverwriteReason
 
-VERSION = importlib.metadata.version("magika")
-
 CONTACT_EMAIL = "magika-dev@google.com"
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
 
-HELP_EPILOG = f"""
-Magika version: "{VERSION}"\f
+# Passing this path means "read the content from stdin".
+STDIN_PATH = Path("-")
+
+
+@functools.lru_cache(maxsize=None)
+def get_magika_version() -> str:
+    # Looking up the package metadata requires scanning sys.path, so we only
+    # do it when (and if) we actually need the version. For the same reason,
+    # we also import importlib.metadata only here.
+    import importlib.metadata
+
+    return importlib.metadata.version("magika")
+
+
+def get_help_epilog() -> str:
+    return f"""
+Magika version: "{get_magika_version()}"\f
 Default model: "{Magika._get_default_model_name()}"
 
 Send any feedback to {CONTACT_EMAIL} or via GitHub issues.
 """
 
 
+class MagikaCommand(click.Command):
+    """A click.Command that builds its epilog only when the help is shown."""
+
+    def format_epilog(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        self.epilog = get_help_epilog()
+        super().format_epilog(ctx, formatter)
+
+
 @click.command(
+    cls=MagikaCommand,
     context_settings=CONTEXT_SETTINGS,
-    epilog=HELP_EPILOG,
 )
 @click.argument(
     "file",
@@ -149,6 +175,8 @@ def main(
     # the argument "file" (which is ugly) and we re-assign it as soon as we can.
     files_paths = file
 
+    dotenv.load_dotenv(dotenv.find_dotenv())
+
     if magic_compatibility_mode:
         # In compatibility mode we disable colors.
         with_colors = False
@@ -162,7 +190,7 @@ def main(
 
     if output_version:
         _l.raw_print_to_stdout("Magika python client")
-        _l.raw_print_to_stdout(f"Magika version: {VERSION}")
+        _l.raw_print_to_stdout(f"Magika version: {get_magika_version()}")
         _l.raw_print_to_stdout(f"Default model: {Magika._get_default_model_name()}")
         sys.exit(0)
 
@@ -172,7 +200,7 @@ def main(
 
     read_from_stdin = False
     for p in files_paths:
-        if str(p) == "-":
+        if p == STDIN_PATH:
             read_from_stdin = True
         elif not p.exists():
             _l.error(f'File or directory "{str(p)}" does not exist.')
@@ -198,27 +226,26 @@ def main(
         sys.exit(1)
 
     if recursive:
-        # recursively enumerate files within directories
+        # Recursively enumerate files within directories. At this point we know
+        # that we are not reading from stdin, so we stat each path only once.
         expanded_paths = []
         for p in files_paths:
-            if p.exists():
-                if p.is_file():
-                    expanded_paths.append(p)
-                elif p.is_dir():
-                    expanded_paths.extend(sorted(p.rglob("*")))
-            elif str(p) == "-":
-                # this is "read from stdin", that's OK
-                pass
-            else:
+            try:
+                mode = p.stat().st_mode
+            except OSError:
                 _l.error(f'File or directory "{str(p)}" does not exist.')
                 sys.exit(1)
-        # the resulting list may still include some directories; thus, we filter them out.
-        files_paths: List[Path] = list(filter(lambda x: not x.is_dir(), expanded_paths))  # type: ignore[no-redef]
+            if stat.S_ISREG(mode):
+                expanded_paths.append(p)
+            elif stat.S_ISDIR(mode):
+                expanded_paths.extend(sorted(walk_files(p)))
+        files_paths = expanded_paths
 
-    _l.info(f"Considering {len(files_paths)} files")
-    _l.debug(f"Files: {files_paths}")
+    _l.info("Considering %d files", len(files_paths))
+    _l.debug("Files: %s", files_paths)
 
-    # Select an alternative model checking: 1) CLI option, 2) env variable.
+    # Select an alternative model checking: 1) CLI option, 2) env variable
+    # (which can also be set via a .env file).
     # If none of these is set, model_dir is left to None, and the Magika module
     # will use the default model.
     if model_dir is None:
@@ -239,38 +266,50 @@ def main(
         _l.error(str(mr))
         sys.exit(1)
 
-    start_color = ""
-    end_color = ""
-
-    color_by_group = {
-        "document": colors.LIGHT_PURPLE,
-        "executable": colors.LIGHT_GREEN,
-        "archive": colors.LIGHT_RED,
-        "audio": colors.YELLOW,
-        "image": colors.YELLOW,
-        "video": colors.YELLOW,
-        "code": colors.LIGHT_BLUE,
-    }
-
-    # updated only when we need to output in JSON format
-    all_predictions: List[Tuple[Path, MagikaResult]] = []
-
-    batches_num = len(files_paths) // batch_size
-    if len(files_paths) % batch_size != 0:
-        batches_num += 1
-    for batch_idx in range(batches_num):
-        batch_files_paths = files_paths[
-            batch_idx * batch_size : (batch_idx + 1) * batch_size
-        ]
-
-        if should_read_from_stdin(files_paths):
-            batch_predictions = [get_magika_result_from_stdin(magika)]
-        else:
-            batch_predictions = magika.identify_paths(batch_files_paths)
+    # Colors only apply to successful predictions. We resolve them once here,
+    # so that the output loop does not need to check with_colors every time.
+    if with_colors:
+        color_by_group = {
+            "document": colors.LIGHT_PURPLE,
+            "executable": colors.LIGHT_GREEN,
+            "archive": colors.LIGHT_RED,
+            "audio": colors.YELLOW,
+            "image": colors.YELLOW,
+            "video": colors.YELLOW,
+            "code": colors.LIGHT_BLUE,
+        }
+        default_color = colors.WHITE
+        reset_color = colors.RESET
+    else:
+        color_by_group = {}
+        default_color = ""
+        reset_color = ""
+    # Groups are plain strings, so this can't be turned into a list indexed by
+    # group; we at least avoid looking up the .get attribute for every line.
+    get_color_by_group = color_by_group.get
+
+    # For JSON output, we stream the elements of the list as we get them. We
+    # hold back the last serialized element, as we only know whether it needs
+    # a trailing comma once we see the next one (or the end of the list).
+    json_pending_element: Optional[str] = None
+
+    batches: Iterable[Tuple[List[Path], List[MagikaResult]]]
+    if read_from_stdin:
+        # There is exactly one input, so there is nothing to batch.
+        batches = [(files_paths, [get_magika_result_from_stdin(magika)])]
+    else:
+        batches = iter_batches_predictions(magika, files_paths, batch_size)
 
+    for batch_files_paths, batch_predictions in batches:
         if json_output:
-            # we do not stream the output for JSON output
-            all_predictions.extend(zip(batch_files_paths, batch_predictions))
+            for result in batch_predictions:
+                if json_pending_element is None:
+                    _l.raw_print_to_stdout("[")
+                else:
+                    _l.raw_print_to_stdout(f"{json_pending_element},")
+                json_pending_element = textwrap.indent(
+                    json.dumps(result_to_dict(result), indent=4), " " * 4
+                )
         elif jsonl_output:
             for file_path, result in zip(batch_files_paths, batch_predictions):
                 _l.raw_print_to_stdout(json.dumps(result_to_dict(result)))
@@ -302,11 +341,10 @@ def main(
                                 f"score={result.prediction.score}]"
                             )
 
-                    if with_colors:
-                        start_color = color_by_group.get(
-                            result.prediction.output.group, colors.WHITE
-                        )
-                        end_color = colors.RESET
+                    start_color = get_color_by_group(
+                        result.prediction.output.group, default_color
+                    )
+                    end_color = reset_color
                 else:
                     output = result.status
                     start_color = ""
@@ -322,17 +360,69 @@ def main(
                         f"{start_color}{file_path}: {output}{end_color}"
                     )
 
+        # We flush once per batch, rather than once per line.
+        sys.stdout.flush()
+
     if json_output:
-        _l.raw_print_to_stdout(
-            json.dumps(
-                [result_to_dict(result) for (_, result) in all_predictions],
-                indent=4,
-            )
-        )
+        # This matches the output of json.dumps(all_results, indent=4).
+        if json_pending_element is None:
+            _l.raw_print_to_stdout("[]")
+        else:
+            _l.raw_print_to_stdout(json_pending_element)
+            _l.raw_print_to_stdout("]")
 
 
-def should_read_from_stdin(files_paths: List[Path]) -> bool:
-    return len(files_paths) == 1 and str(files_paths[0]) == "-"
+def walk_files(root_dir: Path) -> Iterator[Path]:
+    """Yields all the non-directory entries within root_dir, recursively.
+
+    Similarly to Path.rglob, this does not recurse into symlinks to directories
+    and it skips them altogether; symlinks to anything else are yielded. We use
+    os.scandir as it gives us the entry types without additional stat calls.
+    """
+
+    dirs_to_scan = [root_dir]
+    while dirs_to_scan:
+        try:
+            scandir_it = os.scandir(dirs_to_scan.pop())
+        except OSError:
+            # Same as Path.rglob, we skip directories we cannot list.
+            continue
+        with scandir_it:
+            for entry in scandir_it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs_to_scan.append(Path(entry.path))
+                elif not entry.is_dir():
+                    yield Path(entry.path)
+
+
+def iter_batches_predictions(
+    magika: Magika, files_paths: Iterable[Path], batch_size: int
+) -> Iterator[Tuple[List[Path], List[MagikaResult]]]:
+    """Yields (batch_files_paths, batch_predictions) tuples, one per batch, in
+    the same order as files_paths.
+
+    The batches are processed by a background thread, which starts working on
+    the next batch as soon as the current one is handed over to the caller.
+    This way, reading files and running the model overlap with formatting and
+    printing the results of the previous batch.
+    """
+
+    files_paths_it = iter(files_paths)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        pending: Optional[
+            Tuple[List[Path], concurrent.futures.Future[List[MagikaResult]]]
+        ] = None
+        while True:
+            batch_files_paths = list(itertools.islice(files_paths_it, batch_size))
+            if len(batch_files_paths) == 0:
+                break
+            future = executor.submit(magika.identify_paths, batch_files_paths)
+            if pending is not None:
+                yield pending[0], pending[1].result()
+            pending = (batch_files_paths, future)
+        if pending is not None:
+            yield pending[0], pending[1].result()
 
 
 def get_magika_result_from_stdin(magika: Magika) -> MagikaResult:
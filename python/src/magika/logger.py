@@ -16,11 +16,13 @@ from __future__ import annotations
 
 import logging
 import sys
-from typing import Optional, TextIO
+import threading
+from typing import Any, Callable, Optional, TextIO
 
 from magika import colors
 
 _logger: Optional[SimpleLogger] = None
+_logger_lock = threading.Lock()
 
 
 class SimpleLogger:
@@ -30,15 +32,40 @@ class SimpleLogger:
     debug/info/...) are sent to stderr.
     """
 
+    # These are bound in setLevel() to either the actual implementation or to
+    # a no-op, so that disabled log levels cost as little as possible. Similarly
+    # to the logging module, they take a %-style format string and its args,
+    # which are only formatted if the message is actually printed.
+    debug: Callable[..., None]
+    info: Callable[..., None]
+    warning: Callable[..., None]
+    error: Callable[..., None]
+
     def __init__(self, use_colors: bool = False):
-        self.level = logging.WARNING
         self.use_colors = use_colors
+        if use_colors:
+            self._debug_fmt = f"{colors.GREEN}DEBUG: {{}}{colors.RESET}"
+            self._warning_fmt = f"{colors.YELLOW}WARNING: {{}}{colors.RESET}"
+            self._error_fmt = f"{colors.RED}ERROR: {{}}{colors.RESET}"
+        else:
+            self._debug_fmt = "DEBUG: {}"
+            self._warning_fmt = "WARNING: {}"
+            self._error_fmt = "ERROR: {}"
+        self._info_fmt = "INFO: {}"
+        self.setLevel(logging.WARNING)
 
     def setLevel(self, level: int) -> None:
         self.level = level
+        self.debug = self._debug if logging.DEBUG >= level else _noop
+        self.info = self._info if logging.INFO >= level else _noop
+        self.warning = self._warning if logging.WARNING >= level else _noop
+        self.error = self._error if logging.ERROR >= level else _noop
 
     def raw_print_to_stdout(self, msg: str) -> None:
-        self.raw_print(msg, file=sys.stdout)
+        # stdout is used for the actual output, which may be one line per file;
+        # we do not flush after every line, and leave it to the caller to flush
+        # when it makes sense (e.g., after each batch).
+        self.raw_print(msg, file=sys.stdout, flush=False)
 
     def raw_print(
         self, msg: str, file: Optional[TextIO] = None, flush: bool = True
@@ -52,36 +79,32 @@ class SimpleLogger:
             file = sys.stderr
         print(msg, file=file, flush=flush)
 
-    def debug(self, msg: str) -> None:
-        if logging.DEBUG >= self.level:
-            if self.use_colors:
-                self.raw_print(f"{colors.GREEN}DEBUG: {msg}{colors.RESET}")
-            else:
-                self.raw_print(f"DEBUG: {msg}")
+    def _debug(self, msg: str, *args: Any) -> None:
+        self.raw_print(self._debug_fmt.format(msg % args if args else msg))
+
+    def _info(self, msg: str, *args: Any) -> None:
+        self.raw_print(self._info_fmt.format(msg % args if args else msg))
+
+    def _warning(self, msg: str, *args: Any) -> None:
+        self.raw_print(self._warning_fmt.format(msg % args if args else msg))
 
-    def info(self, msg: str) -> None:
-        if logging.INFO >= self.level:
-            self.raw_print(f"INFO: {msg}")
+    def _error(self, msg: str, *args: Any) -> None:
+        self.raw_print(self._error_fmt.format(msg % args if args else msg))
 
-    def warning(self, msg: str) -> None:
-        if logging.WARNING >= self.level:
-            if self.use_colors:
-                self.raw_print(f"{colors.YELLOW}WARNING: {msg}{colors.RESET}")
-            else:
-                self.raw_print(f"WARNING: {msg}")
 
-    def error(self, msg: str) -> None:
-        if logging.ERROR >= self.level:
-            if self.use_colors:
-                self.raw_print(f"{colors.RED}ERROR: {msg}{colors.RESET}")
-            else:
-                self.raw_print(f"ERROR: {msg}")
+def _noop(msg: str, *args: Any) -> None:
+    pass
 
 
 def get_logger(use_colors: bool = False) -> SimpleLogger:
-    global _logger
+    """Return the process-wide logger. Note that use_colors is only taken into
+    account by the first call, which creates it."""
 
-    if _logger is None:
-        _logger = SimpleLogger(use_colors=use_colors)
+    global _logger
 
-    return _logger
+    # The lock makes sure that concurrent first calls do not create (and
+    # configure) different loggers.
+    with _logger_lock:
+        if _logger is None:
+            _logger = SimpleLogger(use_colors=use_colors)
+        return _logger
@@ -13,12 +13,27 @@
 # limitations under the License.
 
 
+import concurrent.futures
+import errno
+import functools
 import json
 import logging
 import os
+import stat
+import threading
 import time
+import weakref
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Set, Tuple
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
 import numpy as np
 import numpy.typing as npt
@@ -34,13 +49,55 @@ from magika.types import (
     MagikaResult,
     ModelConfig,
     ModelFeatures,
-    ModelOutput,
     OverwriteReason,
     PredictionMode,
     Status,
 )
 
 DEFAULT_MODEL_NAME = "standard_v3_0"
+DEFAULT_INFERENCE_BATCH_SIZE = 64
+
+# The path we report for inputs that do not come from a file, e.g., bytes.
+_DASH_PATH = Path("-")
+
+# Overwrite reasons, indexed as in Magika._get_output_idxs_from_dl_results.
+_OVERWRITE_REASONS = (
+    OverwriteReason.NONE,
+    OverwriteReason.OVERWRITE_MAP,
+    OverwriteReason.LOW_CONFIDENCE,
+)
+
+# The errnos for which Path.exists() returns False instead of raising.
+_PATH_NOT_FOUND_ERRNOS = (errno.ENOENT, errno.ENOTDIR, errno.EBADF, errno.ELOOP)
+
+_T = TypeVar("_T")
+
+# The ONNX sessions in use, keyed on the model's path, mtime, and size, see
+# Magika._get_shared_onnx_session(). We only hold weak references, so that a
+# session is freed as soon as no Magika instance uses it anymore.
+_OnnxSessionKey = Tuple[Path, int, int]
+_onnx_sessions: "weakref.WeakValueDictionary[_OnnxSessionKey, rt.InferenceSession]"
+_onnx_sessions = weakref.WeakValueDictionary()
+_onnx_sessions_lock = threading.Lock()
+
+
+def _cache_by_path_and_stat(load: Callable[[Path], _T]) -> Callable[[Path], _T]:
+    """Cache the output of a function loading a file, so that creating several
+    Magika instances with the same model does not re-read and re-parse its
+    config and the content types KB. The cache is keyed on the file's path,
+    mtime, and size, so that updated files are reloaded. Callers must not
+    mutate the returned objects."""
+
+    @functools.lru_cache(maxsize=8)
+    def load_cached(path: Path, mtime_ns: int, size: int) -> _T:
+        return load(path)
+
+    @functools.wraps(load)
+    def wrapper(path: Path) -> _T:
+        path_stat = path.stat()
+        return load_cached(path, path_stat.st_mtime_ns, path_stat.st_size)
+
+    return wrapper
 
 
 class Magika:
@@ -52,6 +109,7 @@ class Magika:
         verbose: bool = False,
         debug: bool = False,
         use_colors: bool = False,
+        inference_batch_size: int = DEFAULT_INFERENCE_BATCH_SIZE,
     ) -> None:
         self._log = get_logger(use_colors=use_colors)
 
@@ -85,20 +143,54 @@ class Magika:
             self._model_config_path
         )
 
-        self._target_labels_space_np = np.array(
-            list(map(str, self._model_config.target_labels_space))
-        )
-
         self._prediction_mode = prediction_mode
 
         self._no_dereference = no_dereference
 
+        if inference_batch_size < 1:
+            raise MagikaError(
+                f"inference_batch_size should be positive, got {inference_batch_size}"
+            )
+        self._inference_batch_size = inference_batch_size
+
         content_types_kb_path = (
             Path(__file__).parent / "config" / "content_types_kb.min.json"
         )
         self._cts_infos = Magika._load_content_types_kb(content_types_kb_path)
 
-        self._onnx_session = self._init_onnx_session()
+        self._init_output_ct_labels_tables()
+
+        # The ONNX session is created on first use (see _get_onnx_session()), as
+        # loading the model is expensive, and it is not needed when all inputs
+        # are handled without the model (e.g., empty or very small files).
+        self._onnx_session: Optional[rt.InferenceSession] = None
+
+        # We bind preallocated buffers to the ONNX session, so that running
+        # inference does not allocate new input and output tensors every time.
+        self._inference_input_buffer = np.empty(
+            (
+                self._inference_batch_size,
+                self._model_config.beg_size
+                + self._model_config.mid_size
+                + self._model_config.end_size,
+            ),
+            dtype=np.int32,
+        )
+        self._inference_output_buffer = np.empty(
+            (self._inference_batch_size, len(self._model_config.target_labels_space)),
+            dtype=np.float32,
+        )
+        self._inference_lock = threading.Lock()
+
+        # The thread pool for the first pass over the paths is created on first
+        # use, and then reused across calls (see _get_first_pass_executor()).
+        self._first_pass_executor: Optional[concurrent.futures.ThreadPoolExecutor] = (
+            None
+        )
+        # The pid of the process that created the thread pool, see
+        # _get_first_pass_executor().
+        self._first_pass_executor_pid = -1
+        self._first_pass_executor_lock = threading.Lock()
 
     def __repr__(self) -> str:
         return str(self)
@@ -185,6 +277,7 @@ class Magika:
         return DEFAULT_MODEL_NAME
 
     @staticmethod
+    @_cache_by_path_and_stat
     def _load_content_types_kb(
         content_types_kb_json_path: Path,
     ) -> Dict[ContentTypeLabel, ContentTypeInfo]:
@@ -222,6 +315,7 @@ class Magika:
         return out
 
     @staticmethod
+    @_cache_by_path_and_stat
     def _load_model_config(model_config_path: Path) -> ModelConfig:
         config = json.loads(model_config_path.read_text())
 
@@ -246,19 +340,143 @@ class Magika:
             },
         )
 
-    def _init_onnx_session(self) -> rt.InferenceSession:
-        start_time = time.time()
+    @staticmethod
+    def _get_shared_onnx_session(model_path: Path) -> rt.InferenceSession:
+        """Return the ONNX session for the given model, creating it if no other
+        Magika instance is using it already. Sharing the session is safe, as
+        onnxruntime's run() can be called concurrently, and each instance binds
+        its own input/output buffers."""
+
+        model_stat = model_path.stat()
+        key = (model_path, model_stat.st_mtime_ns, model_stat.st_size)
+        with _onnx_sessions_lock:
+            onnx_session = _onnx_sessions.get(key)
+            if onnx_session is None:
+                onnx_session = Magika._init_onnx_session(model_path)
+                _onnx_sessions[key] = onnx_session
+            return onnx_session
+
+    @staticmethod
+    def _init_onnx_session(model_path: Path) -> rt.InferenceSession:
         rt.disable_telemetry_events()
 
-        onnx_session = rt.InferenceSession(
-            self._model_path,
+        sess_options = rt.SessionOptions()
+        sess_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # The model is a single chain of operators: there is nothing to run in
+        # parallel across nodes, so we only rely on the intra-op thread pool,
+        # which onnxruntime sizes to the number of physical cores by default.
+        sess_options.execution_mode = rt.ExecutionMode.ORT_SEQUENTIAL
+        sess_options.inter_op_num_threads = 1
+
+        return rt.InferenceSession(
+            model_path,
+            sess_options=sess_options,
             providers=["CPUExecutionProvider"],
         )
-        elapsed_time = 1000 * (time.time() - start_time)
-        self._log.debug(
-            f'ONNX DL model "{self._model_path}" loaded in {elapsed_time:.03f} ms'
+
+    def _init_output_ct_labels_tables(self) -> None:
+        """Precompute, for each index of the model's labels space, what we need
+        to determine the output content type: the (potentially overwritten)
+        label, the generic label to use in case of low confidence, and the
+        score threshold of the prediction mode. These tables are then used to
+        post-process an entire batch of predictions at once, see
+        _get_output_idxs_from_dl_results().
+        """
+
+        target_labels_space = self._model_config.target_labels_space
+        overwrite_map = self._model_config.overwrite_map
+        overwritten_ct_labels = [
+            overwrite_map.get(ct_label, ct_label) for ct_label in target_labels_space
+        ]
+
+        # The output labels space has the (potentially overwritten) model labels
+        # at the same indexes as the model labels space, followed by the generic
+        # labels we return in case of low confidence.
+        labels_num = len(target_labels_space)
+        self._output_labels_space: List[ContentTypeLabel] = overwritten_ct_labels + [
+            ContentTypeLabel.TXT,
+            ContentTypeLabel.UNKNOWN,
+        ]
+        self._dl_cts_infos = [
+            self._get_ct_info(ct_label) for ct_label in target_labels_space
+        ]
+        self._output_cts_infos = [
+            self._get_ct_info(ct_label) for ct_label in self._output_labels_space
+        ]
+        # When we are not in a condition to trust the model, we return generic
+        # labels. Note that here we use an implicit assumption that the model
+        # has, at the very least, got the binary vs. text category right. This
+        # allows us to pick between unknown and txt without the need to read or
+        # scan the file bytes once again.
+        self._low_confidence_output_idxs = np.array(
+            [
+                labels_num if self._get_ct_info(ct_label).is_text else labels_num + 1
+                for ct_label in overwritten_ct_labels
+            ]
+        )
+        self._is_overwritten = np.array(
+            [
+                overwritten_ct_label != ct_label
+                for ct_label, overwritten_ct_label in zip(
+                    target_labels_space, overwritten_ct_labels
+                )
+            ]
         )
-        return onnx_session
+
+        # The prediction modes only differ in the score threshold each label
+        # needs to be trusted: we precompute it, so that the batched check is a
+        # single comparison.
+        if self._prediction_mode == PredictionMode.BEST_GUESS:
+            # We take the model prediction, no matter what the score is.
+            self._effective_thresholds = np.full(labels_num, -np.inf)
+        elif self._prediction_mode == PredictionMode.HIGH_CONFIDENCE:
+            self._effective_thresholds = np.array(
+                [
+                    self._model_config.thresholds.get(
+                        ct_label, self._model_config.medium_confidence_threshold
+                    )
+                    for ct_label in target_labels_space
+                ],
+                dtype=np.float64,
+            )
+        else:
+            assert self._prediction_mode == PredictionMode.MEDIUM_CONFIDENCE
+            self._effective_thresholds = np.full(
+                labels_num, self._model_config.medium_confidence_threshold
+            )
+
+    def _get_first_pass_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Return the thread pool used for the first pass over the paths,
+        creating it on first use. Starting threads is not free, and the CLI
+        calls identify_paths() once per (small) batch: we keep the same pool
+        for the lifetime of this instance (and process)."""
+
+        with self._first_pass_executor_lock:
+            pid = os.getpid()
+            # A forked child inherits the pool, but none of its threads: work
+            # submitted to it would never run, so the child needs its own pool.
+            if (
+                self._first_pass_executor is None
+                or self._first_pass_executor_pid != pid
+            ):
+                self._first_pass_executor = concurrent.futures.ThreadPoolExecutor(
+                    thread_name_prefix="magika"
+                )
+                self._first_pass_executor_pid = pid
+            return self._first_pass_executor
+
+    def _get_onnx_session(self) -> rt.InferenceSession:
+        """Return the ONNX session, creating it on first use. Callers must hold
+        self._inference_lock."""
+
+        if self._onnx_session is None:
+            start_time = time.perf_counter()
+            self._onnx_session = Magika._get_shared_onnx_session(self._model_path)
+            elapsed_time = 1000 * (time.perf_counter() - start_time)
+            self._log.debug(
+                'ONNX DL model "%s" loaded in %.03f ms', self._model_path, elapsed_time
+            )
+        return self._onnx_session
 
     def _get_ct_info(self, content_type: ContentTypeLabel) -> ContentTypeInfo:
         return self._cts_infos[content_type]
@@ -274,37 +492,55 @@ class Magika:
         # that need to be analyzed with the DL model, and we already determine
         # the output for the remaining ones.
 
-        # We use a "str" instead of Path because it makes it easier later on to
-        # serialize.
-        all_outputs: Dict[str, MagikaResult] = {}  # {path: <output>, ...}
+        # We store the outputs by their index in the paths list.
+        all_outputs: List[Optional[MagikaResult]] = [None] * len(paths)
 
-        # We use a list and not the dict because that's what we need later on
-        # for inference.
+        # We use a list with only the files that need the DL model, because
+        # that's what we need later on for inference; features_idxs tracks
+        # their indexes in the paths list.
         all_features: List[Tuple[Path, ModelFeatures]] = []
+        features_idxs: List[int] = []
 
         self._log.debug(
-            f"Processing input files and extracting features for {len(paths)} samples"
+            "Processing input files and extracting features for %d samples", len(paths)
         )
-        start_time = time.time()
-        for path in paths:
-            output, features = self._get_result_or_features_from_path(path)
+        start_time = time.perf_counter()
+        if len(paths) > 1:
+            # This pass is dominated by I/O (stat, open, and reads), which
+            # releases the GIL: we overlap it across files with a thread pool.
+            # Inference is done afterwards, from this thread only, as
+            # onnxruntime already uses its own thread pool.
+            executor = self._get_first_pass_executor()
+            outputs_or_features = list(
+                executor.map(self._get_result_or_features_from_path, paths)
+            )
+        else:
+            outputs_or_features = [
+                self._get_result_or_features_from_path(path) for path in paths
+            ]
+        for idx, (path, (output, features)) in enumerate(
+            zip(paths, outputs_or_features)
+        ):
             if output is not None:
-                all_outputs[str(path)] = output
+                all_outputs[idx] = output
             else:
                 assert features is not None
                 all_features.append((path, features))
-        elapsed_time = 1000 * (time.time() - start_time)
-        self._log.debug(f"First pass and features extracted in {elapsed_time:.03f} ms")
+                features_idxs.append(idx)
+        elapsed_time = 1000 * (time.perf_counter() - start_time)
+        self._log.debug("First pass and features extracted in %.03f ms", elapsed_time)
 
         # Get the outputs via DL for the files that need it.
-        for path_str, result in self._get_results_from_features(all_features).items():
-            all_outputs[path_str] = result
+        for idx, result in zip(
+            features_idxs, self._get_results_from_features(all_features)
+        ):
+            all_outputs[idx] = result
 
-        # Finally, we collect the predictions in a final list, sorted by the
-        # initial paths list (and not by insertion order).
+        # Finally, we check that we have an output for each path.
         sorted_outputs = []
-        for path in paths:
-            sorted_outputs.append(all_outputs[str(path)])
+        for output in all_outputs:
+            assert output is not None
+            sorted_outputs.append(output)
         return sorted_outputs
 
     def _get_result_from_path(self, path: Path) -> MagikaResult:
@@ -326,9 +562,10 @@ class Magika:
         padding_token: int,
         block_size: int,
         use_inputs_at_offsets: bool,
+        file_size: Optional[int] = None,
     ) -> ModelFeatures:
         # TODO: reimplement this using a context manager
-        seekable = File(file_path)
+        seekable = File(file_path, size=file_size)
         mf = Magika._extract_features_from_seekable(
             seekable,
             beg_size,
@@ -402,16 +639,29 @@ class Magika:
         assert mid_size < block_size
         assert end_size < block_size
 
+        if seekable.size <= 2 * block_size and not isinstance(seekable, Buffer):
+            # The beg, mid, and end blocks cover the entire content: we read it
+            # once, and we then work on the in-memory copy.
+            seekable = Buffer(seekable.read_at(0, seekable.size))
+
         # we read at most block_size bytes
         bytes_num_to_read = min(block_size, seekable.size)
 
         if beg_size > 0:
-            beg_content = seekable.read_at(0, bytes_num_to_read).lstrip()
+            beg_block = seekable.read_at(0, bytes_num_to_read)
+            beg_content = beg_block.lstrip()
             beg_ints = Magika._get_beg_ints_with_padding(
                 beg_content, beg_size, padding_token
             )
+            beg_bytes_num = min(beg_size, len(beg_content))
+            # If we do not have enough bytes, the caller may need to inspect the
+            # first block without the model: we keep it to avoid reading it
+            # again.
+            first_block = beg_block if beg_bytes_num < beg_size else None
         else:
-            beg_ints = []
+            beg_ints = np.empty(0, dtype=np.int32)
+            beg_bytes_num = 0
+            first_block = None
 
         if mid_size > 0:
             # mid_idx points to the left-most offset to read for the "mid" component
@@ -423,7 +673,7 @@ class Magika:
                 mid_content, mid_size, padding_token
             )
         else:
-            mid_ints = []
+            mid_ints = np.empty(0, dtype=np.int32)
 
         if end_size > 0:
             end_content = seekable.read_at(
@@ -433,9 +683,18 @@ class Magika:
                 end_content, end_size, padding_token
             )
         else:
-            end_ints = []
-
-        if use_inputs_at_offsets:
+            end_ints = np.empty(0, dtype=np.int32)
+
+        if use_inputs_at_offsets and seekable.size < 0x8000 + 8:
+            # The content is too small to reach any of the offsets, so they are
+            # all padding: we share one (read-only) array among them.
+            offset_padding = np.full(8, padding_token, dtype=np.int32)
+            offset_padding.flags.writeable = False
+            offset_0x8000_0x8007 = offset_padding
+            offset_0x8800_0x8807 = offset_padding
+            offset_0x9000_0x9007 = offset_padding
+            offset_0x9800_0x9807 = offset_padding
+        elif use_inputs_at_offsets:
             offset_0x8000_0x8007 = Magika._get_ints_at_offset_or_padding(
                 seekable, 0x8000, 8, padding_token
             )
@@ -449,10 +708,11 @@ class Magika:
                 seekable, 0x9800, 8, padding_token
             )
         else:
-            offset_0x8000_0x8007 = []
-            offset_0x8800_0x8807 = []
-            offset_0x9000_0x9007 = []
-            offset_0x9800_0x9807 = []
+            no_ints = np.empty(0, dtype=np.int32)
+            offset_0x8000_0x8007 = no_ints
+            offset_0x8800_0x8807 = no_ints
+            offset_0x9000_0x9007 = no_ints
+            offset_0x9800_0x9807 = no_ints
 
         return ModelFeatures(
             beg=beg_ints,
@@ -462,141 +722,140 @@ class Magika:
             offset_0x8800_0x8807=offset_0x8800_0x8807,
             offset_0x9000_0x9007=offset_0x9000_0x9007,
             offset_0x9800_0x9807=offset_0x9800_0x9807,
+            beg_bytes_num=beg_bytes_num,
+            first_block=first_block,
         )
 
     @staticmethod
     def _get_beg_ints_with_padding(
         beg_content: bytes, beg_size: int, padding_token: int
-    ) -> List[int]:
+    ) -> npt.NDArray[np.int32]:
         """Take an (already-stripped) buffer as input and extract beg ints.
-        This returns a list of integers whose length is exactly beg_size. If
+        This returns an array of integers whose length is exactly beg_size. If
         the buffer is bigger than required, take only the initial portion. If
         the buffer is shorter, add padding at the end.
         """
 
-        if beg_size < len(beg_content):
-            # we don't need so many bytes
-            beg_content = beg_content[0:beg_size]
-
-        beg_ints = list(map(int, beg_content))
-
-        if len(beg_ints) < beg_size:
-            # we don't have enough ints, add padding
-            beg_ints = beg_ints + ([padding_token] * (beg_size - len(beg_ints)))
-
-        assert len(beg_ints) == beg_size
-
+        beg_ints = np.full(beg_size, padding_token, dtype=np.int32)
+        beg_ints_num = min(beg_size, len(beg_content))
+        beg_ints[:beg_ints_num] = np.frombuffer(
+            beg_content, dtype=np.uint8, count=beg_ints_num
+        )
         return beg_ints
 
     @staticmethod
     def _get_mid_ints_with_padding(
         mid_content: bytes, mid_size: int, padding_token: int
-    ) -> List[int]:
-        """Take a buffer as input and extract mid ints. This returns a list of
-        integers whose length is exactly mid_size. If the buffer is bigger than
-        required, take only its middle part. If the buffer is shorter, add
+    ) -> npt.NDArray[np.int32]:
+        """Take a buffer as input and extract mid ints. This returns an array
+        of integers whose length is exactly mid_size. If the buffer is bigger
+        than required, take only its middle part. If the buffer is shorter, add
         padding to its left and right. If we need to add an odd number of
         padding integers, add an extra one to the right.
         """
 
+        mid_ints = np.full(mid_size, padding_token, dtype=np.int32)
         if mid_size < len(mid_content):
             mid_idx = (len(mid_content) - mid_size) // 2
-            mid_content = mid_content[mid_idx : mid_idx + mid_size]
-
-        mid_ints = list(map(int, mid_content))
-
-        if len(mid_ints) < mid_size:
-            # we don't have enough ints, add padding
-            padding_size = mid_size - len(mid_ints)
-            padding_size_left = padding_size // 2
-            padding_size_right = padding_size - padding_size_left
-            mid_ints = (
-                ([padding_token] * padding_size_left)
-                + mid_ints
-                + ([padding_token] * padding_size_right)
+            mid_ints[:] = np.frombuffer(
+                mid_content, dtype=np.uint8, count=mid_size, offset=mid_idx
+            )
+        else:
+            padding_size_left = (mid_size - len(mid_content)) // 2
+            mid_ints[padding_size_left : padding_size_left + len(mid_content)] = (
+                np.frombuffer(mid_content, dtype=np.uint8)
             )
-
-        assert len(mid_ints) == mid_size
-
         return mid_ints
 
     @staticmethod
     def _get_end_ints_with_padding(
         end_content: bytes, end_size: int, padding_token: int
-    ) -> List[int]:
+    ) -> npt.NDArray[np.int32]:
         """Take an (already-stripped) buffer as input and extract end ints. This
-        returns a list of integers whose length is exactly end_size.  If the
+        returns an array of integers whose length is exactly end_size.  If the
         buffer is bigger than required, take only the last portion. If the
         buffer is shorter, add padding at the beginning.
         """
 
-        if end_size < len(end_content):
-            # we don't need so many bytes
-            end_content = end_content[len(end_content) - end_size : len(end_content)]
-
-        end_ints = list(map(int, end_content))
-
-        if len(end_ints) < end_size:
-            # we don't have enough ints, add padding
-            end_ints = ([padding_token] * (end_size - len(end_ints))) + end_ints
-
-        assert len(end_ints) == end_size
-
+        end_ints = np.full(end_size, padding_token, dtype=np.int32)
+        end_ints_num = min(end_size, len(end_content))
+        end_ints[end_size - end_ints_num :] = np.frombuffer(
+            end_content,
+            dtype=np.uint8,
+            count=end_ints_num,
+            offset=len(end_content) - end_ints_num,
+        )
         return end_ints
 
     @staticmethod
     def _get_ints_at_offset_or_padding(
         seekable: Seekable, offset: int, size: int, padding_token: int
-    ) -> List[int]:
+    ) -> npt.NDArray[np.int32]:
         if offset + size <= seekable.size:
-            return list(map(int, seekable.read_at(offset, size)))
-        return [padding_token] * size
+            return np.frombuffer(seekable.read_at(offset, size), dtype=np.uint8).astype(
+                np.int32
+            )
+        return np.full(size, padding_token, dtype=np.int32)
 
-    def _get_model_outputs_from_features(
+    def _get_top_predictions_from_features(
         self, all_features: List[Tuple[Path, ModelFeatures]]
-    ) -> List[Tuple[Path, ModelOutput]]:
+    ) -> Tuple[npt.NDArray[np.intp], npt.NDArray[np.float32]]:
+        """Return the index, in the model's labels space, of the top prediction
+        for each sample, and its score."""
+
         raw_preds = self._get_raw_predictions(all_features)
         top_preds_idxs = np.argmax(raw_preds, axis=1)
-        preds_content_types_labels = self._target_labels_space_np[top_preds_idxs]
-        scores = np.max(raw_preds, axis=1)
-
-        return [
-            (path, ModelOutput(ct_label=ContentTypeLabel(ct_label), score=float(score)))
-            for (path, _), ct_label, score in zip(
-                all_features, preds_content_types_labels, scores
-            )
-        ]
+        # We gather the top scores with the indexes we already have, instead of
+        # doing a second pass over the predictions with np.max().
+        scores = np.take_along_axis(
+            raw_preds, top_preds_idxs[:, np.newaxis], axis=1
+        ).squeeze(axis=1)
+        return top_preds_idxs, scores
 
     def _get_results_from_features(
         self, all_features: List[Tuple[Path, ModelFeatures]]
-    ) -> Dict[str, MagikaResult]:
+    ) -> List[MagikaResult]:
+        """Return the results for the given features, in the same order."""
+
         # We now do inference for those files that need it.
 
         if len(all_features) == 0:
             # nothing to be done
-            return {}
+            return []
 
-        results: Dict[str, MagikaResult] = {}
+        results: List[MagikaResult] = []
 
-        for path, model_output in self._get_model_outputs_from_features(all_features):
-            # In additional to the content type label from the DL model, we
-            # also allow for other logic to overwrite such result. For
-            # debugging and information purposes, the JSON output stores
-            # both the raw DL model output and the final output we return to
-            # the user.
+        top_preds_idxs, scores = self._get_top_predictions_from_features(all_features)
 
-            output_ct_label, overwrite_reason = (
-                self._get_output_ct_label_from_dl_result(
-                    model_output.ct_label, model_output.score
-                )
-            )
+        # In additional to the content type label from the DL model, we also
+        # allow for other logic to overwrite such result. For debugging and
+        # information purposes, the JSON output stores both the raw DL model
+        # output and the final output we return to the user.
+        output_idxs, overwrite_reasons = self._get_output_idxs_from_dl_results(
+            top_preds_idxs, scores
+        )
 
-            results[str(path)] = self._get_result_from_labels_and_score(
-                path=path,
-                dl_ct_label=model_output.ct_label,
-                output_ct_label=output_ct_label,
-                score=model_output.score,
-                overwrite_reason=overwrite_reason,
+        # We get the content types infos by index, instead of looking them up
+        # by label for each result.
+        dl_cts_infos = self._dl_cts_infos
+        output_cts_infos = self._output_cts_infos
+        for (path, _), dl_idx, score, output_idx, overwrite_reason in zip(
+            all_features,
+            top_preds_idxs.tolist(),
+            scores.tolist(),
+            output_idxs,
+            overwrite_reasons,
+        ):
+            results.append(
+                MagikaResult(
+                    path=path,
+                    prediction=MagikaPrediction(
+                        dl=dl_cts_infos[dl_idx],
+                        output=output_cts_infos[output_idx],
+                        score=score,
+                        overwrite_reason=overwrite_reason,
+                    ),
+                )
             )
 
         return results
@@ -606,55 +865,33 @@ class Magika:
     ) -> MagikaResult:
         # This is useful to scan from stream of bytes
         if path is None:
-            path = Path("-")
-        all_features = [(Path("-"), features)]
-        result_with_dl = self._get_results_from_features(all_features)["-"]
+            path = _DASH_PATH
+        all_features = [(_DASH_PATH, features)]
+        result_with_dl = self._get_results_from_features(all_features)[0]
         return result_with_dl
 
-    def _get_output_ct_label_from_dl_result(
-        self, dl_ct_label: ContentTypeLabel, score: float
-    ) -> Tuple[ContentTypeLabel, OverwriteReason]:
-        overwrite_reason = OverwriteReason.NONE
-
-        # Overwrite dl_ct_label if specified in the overwrite_map model config
-        output_ct_label = self._model_config.overwrite_map.get(dl_ct_label, dl_ct_label)
-        if output_ct_label != dl_ct_label:
-            overwrite_reason = OverwriteReason.OVERWRITE_MAP
-
-        if self._prediction_mode == PredictionMode.BEST_GUESS:
-            # We take the (potentially overwritten) model prediction, no matter
-            # what the score is.
-            pass
-        elif (
-            self._prediction_mode == PredictionMode.HIGH_CONFIDENCE
-            and score
-            >= self._model_config.thresholds.get(
-                dl_ct_label, self._model_config.medium_confidence_threshold
-            )
-        ):
-            # The model score is higher than the per-content-type
-            # high-confidence threshold, so we keep it.
-            pass
-        elif (
-            self._prediction_mode == PredictionMode.MEDIUM_CONFIDENCE
-            and score >= self._model_config.medium_confidence_threshold
-        ):
-            # The model score is higher than the generic medium-confidence
-            # threshold, so we keep it.
-            pass
-        else:
-            # We are not in a condition to trust the model, we opt to return
-            # generic labels. Note that here we use an implicit assumption that
-            # the model has, at the very least, got the binary vs. text category
-            # right. This allows us to pick between unknown and txt without the
-            # need to read or scan the file bytes once again.
-            overwrite_reason = OverwriteReason.LOW_CONFIDENCE
-            if self._get_ct_info(output_ct_label).is_text:
-                output_ct_label = ContentTypeLabel.TXT
-            else:
-                output_ct_label = ContentTypeLabel.UNKNOWN
+    def _get_output_idxs_from_dl_results(
+        self, dl_idxs: npt.NDArray[np.intp], scores: npt.NDArray[np.float32]
+    ) -> Tuple[List[int], List[OverwriteReason]]:
+        """Given the indexes of the model's predictions in its labels space, and
+        their scores, return the indexes of the output content types in
+        self._output_labels_space and the overwrite reasons, computed with a
+        handful of array operations."""
+
+        # The thresholds come from the model config as Python floats, i.e.,
+        # float64: we compare the scores at the same precision.
+        scores = scores.astype(np.float64)
+
+        is_confident = scores >= self._effective_thresholds[dl_idxs]
+        output_idxs = np.where(
+            is_confident, dl_idxs, self._low_confidence_output_idxs[dl_idxs]
+        )
+        overwrite_reason_idxs = np.where(is_confident, self._is_overwritten[dl_idxs], 2)
 
-        return output_ct_label, overwrite_reason
+        return (
+            output_idxs.tolist(),
+            [_OVERWRITE_REASONS[idx] for idx in overwrite_reason_idxs.tolist()],
+        )
 
     def _get_result_from_labels_and_score(
         self,
@@ -690,6 +927,10 @@ class Magika:
         batching.
         """
 
+        # We read the model config's attributes a few times per file: we look it
+        # up only once.
+        model_config = self._model_config
+
         if self._no_dereference and path.is_symlink():
             result = self._get_result_from_labels_and_score(
                 path=path,
@@ -699,11 +940,22 @@ class Magika:
             )
             return result, None
 
-        if not path.exists():
+        # We stat the path only once, instead of going through exists(),
+        # is_file(), stat(), and is_dir(), which all stat it again.
+        try:
+            path_stat = path.stat()
+        except OSError as e:
+            # Same errors that Path.exists() treats as "does not exist".
+            if e.errno not in _PATH_NOT_FOUND_ERRNOS:
+                raise
+            return MagikaResult(path=path, status=Status.FILE_NOT_FOUND_ERROR), None
+        except ValueError:
+            # E.g., the path contains a null byte, for which Path.exists()
+            # returns False as well.
             return MagikaResult(path=path, status=Status.FILE_NOT_FOUND_ERROR), None
 
-        if path.is_file():
-            if path.stat().st_size == 0:
+        if stat.S_ISREG(path_stat.st_mode):
+            if path_stat.st_size == 0:
                 result = self._get_result_from_labels_and_score(
                     path=path,
                     dl_ct_label=ContentTypeLabel.UNDEFINED,
@@ -715,30 +967,31 @@ class Magika:
             elif not os.access(path, os.R_OK):
                 return MagikaResult(path=path, status=Status.PERMISSION_ERROR), None
 
-            elif path.stat().st_size <= self._model_config.min_file_size_for_dl:
+            elif path_stat.st_size <= model_config.min_file_size_for_dl:
                 result = self._get_result_from_first_block_of_file(path)
                 return result, None
 
             else:
                 file_features = Magika._extract_features_from_path(
                     path,
-                    self._model_config.beg_size,
-                    self._model_config.mid_size,
-                    self._model_config.end_size,
-                    self._model_config.padding_token,
-                    self._model_config.block_size,
-                    self._model_config.use_inputs_at_offsets,
+                    model_config.beg_size,
+                    model_config.mid_size,
+                    model_config.end_size,
+                    model_config.padding_token,
+                    model_config.block_size,
+                    model_config.use_inputs_at_offsets,
+                    file_size=path_stat.st_size,
                 )
                 # Check whether we have enough bytes for a meaningful
                 # detection, and not just padding.
-                if (
-                    file_features.beg[self._model_config.min_file_size_for_dl - 1]
-                    == self._model_config.padding_token
-                ):
-                    # If the n-th token is padding, then it means that,
-                    # post-stripping, we do not have enough meaningful
-                    # bytes.
-                    result = self._get_result_from_first_block_of_file(path)
+                if file_features.beg_bytes_num < model_config.min_file_size_for_dl:
+                    # Post-stripping, we do not have enough meaningful bytes.
+                    if file_features.first_block is not None:
+                        result = self._get_result_from_few_bytes(
+                            file_features.first_block, path
+                        )
+                    else:
+                        result = self._get_result_from_first_block_of_file(path)
                     return result, None
 
                 else:
@@ -747,7 +1000,7 @@ class Magika:
                     # features.append((path, file_features))
                     return None, file_features
 
-        elif path.is_dir():
+        elif stat.S_ISDIR(path_stat.st_mode):
             result = self._get_result_from_labels_and_score(
                 path=path,
                 dl_ct_label=ContentTypeLabel.UNDEFINED,
@@ -770,38 +1023,35 @@ class Magika:
     def _get_result_or_features_from_bytes(
         self, content: bytes
     ) -> Tuple[Optional[MagikaResult], Optional[ModelFeatures]]:
+        model_config = self._model_config
+
         if len(content) == 0:
             result = self._get_result_from_labels_and_score(
-                path=Path("-"),
+                path=_DASH_PATH,
                 dl_ct_label=ContentTypeLabel.UNDEFINED,
                 output_ct_label=ContentTypeLabel.EMPTY,
                 score=1.0,
             )
             return result, None
 
-        elif len(content) <= self._model_config.min_file_size_for_dl:
+        elif len(content) <= model_config.min_file_size_for_dl:
             result = self._get_result_from_few_bytes(content)
             return result, None
 
         else:
             file_features = Magika._extract_features_from_bytes(
                 content,
-                self._model_config.beg_size,
-                self._model_config.mid_size,
-                self._model_config.end_size,
-                self._model_config.padding_token,
-                self._model_config.block_size,
-                self._model_config.use_inputs_at_offsets,
+                model_config.beg_size,
+                model_config.mid_size,
+                model_config.end_size,
+                model_config.padding_token,
+                model_config.block_size,
+                model_config.use_inputs_at_offsets,
             )
             # Check whether we have enough bytes for a meaningful
             # detection, and not just padding.
-            if (
-                file_features.beg[self._model_config.min_file_size_for_dl - 1]
-                == self._model_config.padding_token
-            ):
-                # If the n-th token is padding, then it means that,
-                # post-stripping, we do not have enough meaningful
-                # bytes.
+            if file_features.beg_bytes_num < model_config.min_file_size_for_dl:
+                # Post-stripping, we do not have enough meaningful bytes.
                 result = self._get_result_from_few_bytes(content)
                 return result, None
 
@@ -813,13 +1063,25 @@ class Magika:
         raise Exception("unreachable")
 
     def _get_result_from_first_block_of_file(self, path: Path) -> MagikaResult:
-        # We read at most "block_size" bytes
-        with open(path, "rb") as f:
-            content = f.read(self._model_config.block_size)
-        return self._get_result_from_few_bytes(content, path)
+        # We read at most "block_size" bytes. We use an unbuffered file: a
+        # buffered one would allocate its own buffer and copy the content once
+        # more. An unbuffered read may return fewer bytes than requested, so we
+        # keep reading until we get "block_size" bytes or we reach the end of
+        # the file.
+        block_size = self._model_config.block_size
+        chunks = []
+        bytes_num_read = 0
+        with open(path, "rb", buffering=0) as f:
+            while bytes_num_read < block_size:
+                chunk = f.read(block_size - bytes_num_read)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                bytes_num_read += len(chunk)
+        return self._get_result_from_few_bytes(b"".join(chunks), path)
 
     def _get_result_from_few_bytes(
-        self, content: bytes, path: Path = Path("-")
+        self, content: bytes, path: Path = _DASH_PATH
     ) -> MagikaResult:
         assert len(content) <= 4 * self._model_config.block_size
         ct_label = self._get_ct_label_from_few_bytes(content)
@@ -831,6 +1093,9 @@ class Magika:
         )
 
     def _get_ct_label_from_few_bytes(self, content: bytes) -> ContentTypeLabel:
+        # ASCII is valid UTF-8: for the common case, we can skip decoding.
+        if content.isascii():
+            return ContentTypeLabel.TXT
         try:
             ct_label = ContentTypeLabel.TXT
             _ = content.decode("utf-8")
@@ -846,42 +1111,62 @@ class Magika:
         matrix encoding the predictions.
         """
 
-        start_time = time.time()
-        X_bytes = []
-        for _, fs in features:
-            sample_bytes = []
-            if self._model_config.beg_size > 0:
-                sample_bytes.extend(fs.beg[: self._model_config.beg_size])
-            if self._model_config.mid_size > 0:
-                sample_bytes.extend(fs.mid[: self._model_config.mid_size])
-            if self._model_config.end_size > 0:
-                sample_bytes.extend(fs.end[-self._model_config.end_size :])
-            X_bytes.append(sample_bytes)
-        X = np.array(X_bytes, dtype=np.int32)
-        elapsed_time = 1000 * (time.time() - start_time)
-        self._log.debug(f"DL input prepared in {elapsed_time:.03f} ms")
-
         raw_predictions_list = []
-        samples_num = X.shape[0]
+        samples_num = len(features)
 
-        max_internal_batch_size = 1000
-        batches_num = samples_num // max_internal_batch_size
-        if samples_num % max_internal_batch_size != 0:
+        # We prepare the DL input one (internal) batch at a time, so that the
+        # peak memory usage does not grow with the number of samples.
+        batch_size = self._inference_batch_size
+        batches_num = samples_num // batch_size
+        if samples_num % batch_size != 0:
             batches_num += 1
 
-        for batch_idx in range(batches_num):
-            self._log.debug(
-                f"Getting raw predictions for (internal) batch {batch_idx+1}/{batches_num}"
-            )
-            start_idx = batch_idx * max_internal_batch_size
-            end_idx = min((batch_idx + 1) * max_internal_batch_size, samples_num)
-
-            start_time = time.time()
-            batch_raw_predictions = self._onnx_session.run(
-                ["target_label"], {"bytes": X[start_idx:end_idx, :]}
-            )[0]
-            elapsed_time = 1000 * (time.time() - start_time)
-            self._log.debug(f"DL raw prediction in {elapsed_time:.03f} ms")
+        beg_size = self._model_config.beg_size
+        mid_size = self._model_config.mid_size
+        end_size = self._model_config.end_size
+
+        # The input and output buffers are shared across calls, so only one
+        # thread at a time can use them.
+        with self._inference_lock:
+            onnx_session = self._get_onnx_session()
+            io_binding = onnx_session.io_binding()
+            for batch_idx in range(batches_num):
+                self._log.debug(
+                    "Getting raw predictions for (internal) batch %d/%d",
+                    batch_idx + 1,
+                    batches_num,
+                )
+                start_idx = batch_idx * batch_size
+                end_idx = min((batch_idx + 1) * batch_size, samples_num)
+
+                start_time = time.perf_counter()
+                X = self._inference_input_buffer[: end_idx - start_idx]
+                for sample_idx, (_, fs) in enumerate(features[start_idx:end_idx]):
+                    if beg_size > 0:
+                        X[sample_idx, :beg_size] = fs.beg[:beg_size]
+                    if mid_size > 0:
+                        X[sample_idx, beg_size : beg_size + mid_size] = fs.mid[
+                            :mid_size
+                        ]
+                    if end_size > 0:
+                        X[sample_idx, beg_size + mid_size :] = fs.end[-end_size:]
+                elapsed_time = 1000 * (time.perf_counter() - start_time)
+                self._log.debug("DL input prepared in %.03f ms", elapsed_time)
+
+                start_time = time.perf_counter()
+                Y = self._inference_output_buffer[: end_idx - start_idx]
+                io_binding.bind_cpu_input("bytes", X)
+                io_binding.bind_output(
+                    "target_label",
+                    device_type="cpu",
+                    element_type=np.float32,
+                    shape=Y.shape,
+                    buffer_ptr=Y.ctypes.data,
+                )
+                onnx_session.run_with_iobinding(io_binding)
+                elapsed_time = 1000 * (time.perf_counter() - start_time)
+                self._log.debug("DL raw prediction in %.03f ms", elapsed_time)
 
-            raw_predictions_list.append(batch_raw_predictions)
+                # Y is overwritten by the next batch, so we keep a copy.
+                raw_predictions_list.append(Y.copy())
         return np.concatenate(raw_predictions_list)
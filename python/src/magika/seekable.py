@@ -13,7 +13,12 @@
 # limitations under the License.
 
 import abc
+import os
 from pathlib import Path
+from typing import Optional
+
+# os.pread is not available on all platforms (e.g., Windows).
+_HAS_PREAD = hasattr(os, "pread")
 
 
 class Seekable(abc.ABC):
@@ -33,16 +38,38 @@ class Seekable(abc.ABC):
 
 
 class File(Seekable):
-    def __init__(self, path: Path) -> None:
+    def __init__(self, path: Path, size: Optional[int] = None) -> None:
+        """If the caller has already stat'ed the file, it can pass its size, so
+        that we do not stat it again."""
         super().__init__()
-        self._f = open(path, "rb")
-        self._size = path.stat().st_size
+        # We only do a few reads at given offsets, so we do not need buffering.
+        self._f = open(path, "rb", buffering=0)
+        if size is None:
+            size = os.fstat(self._f.fileno()).st_size
+        self._size = size
 
     def read_at(self, offset: int, size: int) -> bytes:
         if size == 0:
             return b""
 
         assert offset + size <= self.size
+        # A single (unbuffered) read may return fewer bytes than requested, so
+        # we keep reading until we get "size" bytes or we reach the end of the
+        # file (e.g., if it got truncated in the meantime).
+        chunks = []
+        bytes_num_read = 0
+        while bytes_num_read < size:
+            chunk = self._read_chunk_at(offset + bytes_num_read, size - bytes_num_read)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+            bytes_num_read += len(chunk)
+        return b"".join(chunks)
+
+    def _read_chunk_at(self, offset: int, size: int) -> bytes:
+        if _HAS_PREAD:
+            # One syscall, instead of a seek() followed by a read().
+            return os.pread(self._f.fileno(), size, offset)
         self._f.seek(offset, 0)  # whence = 0: start of the file
         return self._f.read(size)
 
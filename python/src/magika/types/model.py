@@ -13,23 +13,36 @@
 # limitations under the License.
 
 
+from __future__ import annotations
+
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List, Optional
 
 from magika.types.content_type_label import ContentTypeLabel
 
+if TYPE_CHECKING:
+    # magika.types is imported by `import magika`, which must not load numpy.
+    import numpy as np
+    import numpy.typing as npt
 
-@dataclass(frozen=True)
+
+# The fields are NumPy arrays, for which == is element-wise: the generated
+# __eq__ would raise, so we compare by identity instead.
+@dataclass(frozen=True, eq=False)
 class ModelFeatures:
-    beg: List[int]
-    mid: List[int]
-    end: List[int]
+    beg: npt.NDArray[np.int32]
+    mid: npt.NDArray[np.int32]
+    end: npt.NDArray[np.int32]
     # for ISO
-    offset_0x8000_0x8007: List[int]
-    offset_0x8800_0x8807: List[int]
-    offset_0x9000_0x9007: List[int]
+    offset_0x8000_0x8007: npt.NDArray[np.int32]
+    offset_0x8800_0x8807: npt.NDArray[np.int32]
+    offset_0x9000_0x9007: npt.NDArray[np.int32]
     # for UDF
-    offset_0x9800_0x9807: List[int]
+    offset_0x9800_0x9807: npt.NDArray[np.int32]
+    # how many of the beg ints come from the content, and not from padding
+    beg_bytes_num: int
+    # the first block of the content, only kept when beg needed padding
+    first_block: Optional[bytes] = None
 
 
 @dataclass(frozen=True)
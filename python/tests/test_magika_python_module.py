@@ -12,14 +12,21 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gc
+import multiprocessing
 import signal
+import subprocess
+import sys
 import tempfile
+import warnings
+import weakref
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Tuple
 
+import numpy as np
 import pytest
 
-from magika import Magika, PredictionMode
+from magika import Magika, MagikaError, PredictionMode
 from magika.types import (
     ContentTypeInfo,
     ContentTypeLabel,
@@ -38,6 +45,29 @@ def test_magika_module_check_version() -> None:
     assert isinstance(magika_module.__version__, str)
 
 
+def test_magika_module_import_is_lazy() -> None:
+    # We check this in a fresh interpreter, as this one has already imported
+    # numpy and onnxruntime.
+    p = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import magika; "
+            "print('numpy' in sys.modules, 'onnxruntime' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert p.stdout.strip() == "False False"
+
+
+def test_magika_module_submodule_is_reachable() -> None:
+    import magika as magika_module
+
+    assert magika_module.magika.Magika is Magika
+
+
 @pytest.mark.smoketest
 def test_magika_module_one_basic_test() -> None:
     model_dir = utils.get_default_model_dir()
@@ -68,6 +98,72 @@ def test_magika_module_with_basic_tests_by_paths() -> None:
     check_results_vs_expected_results(tests_paths, results)
 
 
+def test_magika_module_with_basic_tests_by_paths_small_batches() -> None:
+    model_dir = utils.get_default_model_dir()
+    tests_paths = utils.get_basic_test_files_paths()
+
+    m = Magika(model_dir=model_dir, inference_batch_size=3)
+    results = m.identify_paths(tests_paths)
+    check_results_vs_expected_results(tests_paths, results)
+
+
+def test_magika_module_with_invalid_inference_batch_size() -> None:
+    with pytest.raises(MagikaError):
+        _ = Magika(inference_batch_size=0)
+
+
+def test_magika_module_instances_share_onnx_session() -> None:
+    m1 = Magika()
+    m2 = Magika(prediction_mode=PredictionMode.BEST_GUESS)
+
+    with m1._inference_lock:
+        onnx_session_1 = m1._get_onnx_session()
+    with m2._inference_lock:
+        onnx_session_2 = m2._get_onnx_session()
+    assert onnx_session_1 is onnx_session_2
+
+
+def test_magika_module_onnx_session_is_freed_with_instances() -> None:
+    m = Magika()
+    with m._inference_lock:
+        onnx_session_ref = weakref.ref(m._get_onnx_session())
+
+    del m
+    gc.collect()
+    assert onnx_session_ref() is None
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires the fork start method",
+)
+def test_magika_module_identify_paths_after_fork() -> None:
+    tests_paths = utils.get_basic_test_files_paths()[:2]
+
+    m = Magika()
+    # This creates the first pass thread pool in the parent process.
+    expected_labels = [r.output.label for r in m.identify_paths(tests_paths)]
+
+    ctx = multiprocessing.get_context("fork")
+    results_queue = ctx.Queue()
+
+    def identify_paths_in_child() -> None:
+        results_queue.put([r.output.label for r in m.identify_paths(tests_paths)])
+
+    child = ctx.Process(target=identify_paths_in_child)
+    with warnings.catch_warnings():
+        # Recent python versions warn about forking a multi-threaded process.
+        warnings.simplefilter("ignore", DeprecationWarning)
+        child.start()
+    try:
+        labels = results_queue.get(timeout=60)
+    finally:
+        child.join(timeout=10)
+        if child.is_alive():
+            child.kill()
+    assert labels == expected_labels
+
+
 def test_magika_module_with_basic_tests_by_path() -> None:
     model_dir = utils.get_default_model_dir()
     tests_paths = utils.get_basic_test_files_paths()
@@ -186,36 +282,36 @@ def test_magika_module_with_python_and_non_python_content() -> None:
 def test_magika_module_with_different_prediction_modes() -> None:
     model_dir = utils.get_default_model_dir()
     m = Magika(model_dir=model_dir, prediction_mode=PredictionMode.BEST_GUESS)
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.01) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.01) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.40) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.40) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.60) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.60) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.99) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.99) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
 
     m = Magika(model_dir=model_dir, prediction_mode=PredictionMode.MEDIUM_CONFIDENCE)
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.01) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.01) == (
         ContentTypeLabel.TXT,
         OverwriteReason.LOW_CONFIDENCE,
     )
-    assert m._get_output_ct_label_from_dl_result(
-        ContentTypeLabel.PYTHON, m._model_config.medium_confidence_threshold - 0.01
+    assert get_output_ct_label_from_dl_result(
+        m, ContentTypeLabel.PYTHON, m._model_config.medium_confidence_threshold - 0.01
     ) == (ContentTypeLabel.TXT, OverwriteReason.LOW_CONFIDENCE)
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.60) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.60) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.99) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.99) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
@@ -224,17 +320,17 @@ def test_magika_module_with_different_prediction_modes() -> None:
     high_confidence_threshold = m._model_config.thresholds.get(
         ContentTypeLabel.PYTHON, m._model_config.medium_confidence_threshold
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.01) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.01) == (
         ContentTypeLabel.TXT,
         OverwriteReason.LOW_CONFIDENCE,
     )
-    assert m._get_output_ct_label_from_dl_result(
-        ContentTypeLabel.PYTHON, high_confidence_threshold - 0.01
+    assert get_output_ct_label_from_dl_result(
+        m, ContentTypeLabel.PYTHON, high_confidence_threshold - 0.01
     ) == (ContentTypeLabel.TXT, OverwriteReason.LOW_CONFIDENCE)
-    assert m._get_output_ct_label_from_dl_result(
-        ContentTypeLabel.PYTHON, high_confidence_threshold + 0.01
+    assert get_output_ct_label_from_dl_result(
+        m, ContentTypeLabel.PYTHON, high_confidence_threshold + 0.01
     ) == (ContentTypeLabel.PYTHON, OverwriteReason.NONE)
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.99) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.99) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
@@ -244,22 +340,47 @@ def test_magika_module_with_different_prediction_modes() -> None:
     high_confidence_threshold = m._model_config.thresholds.get(
         ContentTypeLabel.PYTHON, m._model_config.medium_confidence_threshold
     )
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.01) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.01) == (
         ContentTypeLabel.TXT,
         OverwriteReason.LOW_CONFIDENCE,
     )
-    assert m._get_output_ct_label_from_dl_result(
-        ContentTypeLabel.PYTHON, high_confidence_threshold - 0.01
+    assert get_output_ct_label_from_dl_result(
+        m, ContentTypeLabel.PYTHON, high_confidence_threshold - 0.01
     ) == (ContentTypeLabel.TXT, OverwriteReason.LOW_CONFIDENCE)
-    assert m._get_output_ct_label_from_dl_result(
-        ContentTypeLabel.PYTHON, high_confidence_threshold + 0.01
+    assert get_output_ct_label_from_dl_result(
+        m, ContentTypeLabel.PYTHON, high_confidence_threshold + 0.01
     ) == (ContentTypeLabel.PYTHON, OverwriteReason.NONE)
-    assert m._get_output_ct_label_from_dl_result(ContentTypeLabel.PYTHON, 0.99) == (
+    assert get_output_ct_label_from_dl_result(m, ContentTypeLabel.PYTHON, 0.99) == (
         ContentTypeLabel.PYTHON,
         OverwriteReason.NONE,
     )
 
 
+def test_magika_module_output_ct_labels_match_reference_implementation() -> None:
+    model_dir = utils.get_default_model_dir()
+    for prediction_mode in PredictionMode:
+        m = Magika(model_dir=model_dir, prediction_mode=prediction_mode)
+        labels_num = len(m._model_config.target_labels_space)
+        for score in [0.01, 0.40, 0.50, 0.60, 0.90, 0.99]:
+            dl_idxs = np.arange(labels_num)
+            scores = np.full(labels_num, score, dtype=np.float32)
+            output_idxs, overwrite_reasons = m._get_output_idxs_from_dl_results(
+                dl_idxs, scores
+            )
+            for dl_ct_label, output_idx, overwrite_reason in zip(
+                m._model_config.target_labels_space,
+                output_idxs,
+                overwrite_reasons,
+            ):
+                assert reference_output_ct_label_from_dl_result(
+                    m, dl_ct_label, float(scores[0])
+                ) == (m._output_labels_space[output_idx], overwrite_reason)
+                assert (
+                    m._output_cts_infos[output_idx].label
+                    == m._output_labels_space[output_idx]
+                )
+
+
 def test_magika_module_with_directory() -> None:
     m = Magika()
 
@@ -330,6 +451,24 @@ def test_magika_module_with_non_existing_file() -> None:
         assert res.status == Status.FILE_NOT_FOUND_ERROR
 
 
+def test_magika_module_with_invalid_path() -> None:
+    m = Magika()
+
+    with tempfile.TemporaryDirectory() as td:
+        invalid_path = Path(td) / "invalid\x00path.txt"
+        test_path = Path(td) / "test.txt"
+        test_path.write_text("text")
+
+        # An invalid path must not prevent the other paths from being scanned.
+        results = m.identify_paths([invalid_path, test_path])
+        assert results[0].path == invalid_path
+        assert not results[0].ok
+        assert results[0].status == Status.FILE_NOT_FOUND_ERROR
+        assert results[1].path == test_path
+        assert results[1].ok
+        assert results[1].prediction.output.label == ContentTypeLabel.TXT
+
+
 def test_magika_module_with_permission_error() -> None:
     m = Magika()
 
@@ -517,6 +656,65 @@ def test_get_model_and_output_content_types() -> None:
     }.issubset(model_content_types_set)
 
 
+def get_output_ct_label_from_dl_result(
+    m: Magika, dl_ct_label: ContentTypeLabel, score: float
+) -> Tuple[ContentTypeLabel, OverwriteReason]:
+    """Post-process a single model prediction, as Magika does in batches."""
+
+    dl_idx = m._model_config.target_labels_space.index(dl_ct_label)
+    output_idxs, overwrite_reasons = m._get_output_idxs_from_dl_results(
+        np.array([dl_idx], dtype=np.intp), np.array([score], dtype=np.float32)
+    )
+    return m._output_labels_space[output_idxs[0]], overwrite_reasons[0]
+
+
+def reference_output_ct_label_from_dl_result(
+    m: Magika, dl_ct_label: ContentTypeLabel, score: float
+) -> Tuple[ContentTypeLabel, OverwriteReason]:
+    """Straightforward implementation of how the output content type is
+    determined, one prediction at a time. Magika precomputes per-label tables
+    to do this in batches: we use this to check that they agree."""
+
+    overwrite_reason = OverwriteReason.NONE
+
+    # Overwrite dl_ct_label if specified in the overwrite_map model config
+    output_ct_label = m._model_config.overwrite_map.get(dl_ct_label, dl_ct_label)
+    if output_ct_label != dl_ct_label:
+        overwrite_reason = OverwriteReason.OVERWRITE_MAP
+
+    if m._prediction_mode == PredictionMode.BEST_GUESS:
+        # We take the (potentially overwritten) model prediction, no matter
+        # what the score is.
+        pass
+    elif (
+        m._prediction_mode == PredictionMode.HIGH_CONFIDENCE
+        and score
+        >= m._model_config.thresholds.get(
+            dl_ct_label, m._model_config.medium_confidence_threshold
+        )
+    ):
+        # The model score is higher than the per-content-type high-confidence
+        # threshold, so we keep it.
+        pass
+    elif (
+        m._prediction_mode == PredictionMode.MEDIUM_CONFIDENCE
+        and score >= m._model_config.medium_confidence_threshold
+    ):
+        # The model score is higher than the generic medium-confidence
+        # threshold, so we keep it.
+        pass
+    else:
+        # We are not in a condition to trust the model: we return generic
+        # labels, picked according to the predicted label's category.
+        overwrite_reason = OverwriteReason.LOW_CONFIDENCE
+        if m._get_ct_info(output_ct_label).is_text:
+            output_ct_label = ContentTypeLabel.TXT
+        else:
+            output_ct_label = ContentTypeLabel.UNKNOWN
+
+    return output_ct_label, overwrite_reason
+
+
 def get_expected_content_type_label_from_test_file_path(
     test_path: Path,
 ) -> ContentTypeLabel: